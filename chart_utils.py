@@ -1,6 +1,10 @@
+import matplotlib
+matplotlib.use('Agg')  # بک‌اند غیرتعاملی؛ اجازه می‌دهد Figure ها بین فراخوانی‌ها نگه داشته شوند
 import matplotlib.pyplot as plt
 import io
 import os
+import threading
+from functools import lru_cache
 from matplotlib import font_manager
 import arabic_reshaper
 from bidi.algorithm import get_display
@@ -11,52 +15,67 @@ from bidi.algorithm import get_display
 font_path = "./fonts/Iranian-Sans.ttf"
 font_prop = font_manager.FontProperties(fname=font_path)
 
+@lru_cache(maxsize=512)
 def reshape_farsi(text):
     reshaped = arabic_reshaper.reshape(text)  # اصلاح اتصال حروف
     return get_display(reshaped)              # راست‌چین‌سازی متن
 
+# سطح فشرده‌سازی پایین‌تر PNG: کمی فایل بزرگ‌تر، خروجی خیلی سریع‌تر
+_PNG_SAVE_OPTS = {'compress_level': 3, 'optimize': False}
+
+# عنوان‌های ثابت نمودارها، یک بار شکل‌دهی می‌شوند
+_TITLE_PIE = reshape_farsi("درصد دسته‌های رفتاری مشتریان")
+_TITLE_BAR = reshape_farsi("تعداد مشتریان در وضعیت‌های زمانی")
+_YLABEL_BAR = reshape_farsi("تعداد")
+_XLABEL_BAR = reshape_farsi("وضعیت زمانی")
+
+# Figure ها یک بار ساخته و بین فراخوانی‌ها استفاده مجدد می‌شوند (ساخت Figure پرهزینه است)
+_CHART_LOCK = threading.Lock()
+_FIG_PIE, _AX_PIE = plt.subplots(figsize=(7, 7))
+_FIG_BAR, _AX_BAR = plt.subplots(figsize=(8, 5))
+
 def create_rfm_pie_chart(df_segmented):
     counts = df_segmented["دسته رفتاری نهایی"].value_counts()
+    counts = counts[counts > 0]  # ستون Categorical دسته‌های خالی هم برمی‌گرداند
     labels = [reshape_farsi(label) for label in counts.index.tolist()]
     sizes = counts.values.tolist()
 
-    fig, ax = plt.subplots(figsize=(7, 7))
-    ax.pie(
-        sizes,
-        labels=labels,
-        autopct='%1.1f%%',
-        startangle=120,
-        textprops={'fontproperties': font_prop}
-    )
-    ax.axis('equal')
-    plt.title(reshape_farsi("درصد دسته‌های رفتاری مشتریان"), fontproperties=font_prop, fontsize=14)
-
-    buf = io.BytesIO()
-    plt.savefig(buf, format='png')
+    with _CHART_LOCK:
+        ax = _AX_PIE
+        ax.clear()
+        ax.pie(
+            sizes,
+            labels=labels,
+            autopct='%1.1f%%',
+            startangle=120,
+            textprops={'fontproperties': font_prop}
+        )
+        ax.axis('equal')
+        ax.set_title(_TITLE_PIE, fontproperties=font_prop, fontsize=14)
+
+        buf = io.BytesIO()
+        _FIG_PIE.savefig(buf, format='png', pil_kwargs=_PNG_SAVE_OPTS)
     buf.seek(0)
-    plt.close()
     return buf
 
 
 # Bar chart
-def reshape_farsi(text):
-    reshaped = arabic_reshaper.reshape(text)
-    return get_display(reshaped)
+# برچسب‌های فارسی وضعیت‌ها، یک بار در زمان import شکل‌دهی می‌شوند
+_TAM_LABELS_FA = {
+    "Active": reshape_farsi("فعال"),
+    "At Risk": reshape_farsi("در خطر"),
+    "Inactive": reshape_farsi("غیرفعال"),
+    "Lost": reshape_farsi("از دست رفته"),
+    "No Purchase": reshape_farsi("فاقد خرید"),
+}
 
 def create_tam_bar_chart(df_segmented):
     counts = df_segmented["وضعیت زمانی"].value_counts()
+    counts = counts[counts > 0]  # ستون Categorical دسته‌های خالی هم برمی‌گرداند
     statuses = counts.index.tolist()
     values = counts.values.tolist()
 
-    label_map = {
-        "Active": "فعال",
-        "At Risk": "در خطر",
-        "Inactive": "غیرفعال",
-        "Lost": "از دست رفته",
-        "No Purchase": "فاقد خرید"
-    }
-
-    labels_fa = [reshape_farsi(label_map.get(st, st)) for st in statuses]
+    labels_fa = [_TAM_LABELS_FA.get(st) or reshape_farsi(st) for st in statuses]
 
     # 🎨 رنگ‌ها به ترتیب وضعیت‌ها
     color_map = {
@@ -69,22 +88,23 @@ def create_tam_bar_chart(df_segmented):
 
     bar_colors = [color_map.get(st, "#888") for st in statuses]
 
-    fig, ax = plt.subplots(figsize=(8, 5))
-    bars = ax.bar(labels_fa, values, color=bar_colors)
+    with _CHART_LOCK:
+        ax = _AX_BAR
+        ax.clear()
+        bars = ax.bar(labels_fa, values, color=bar_colors)
 
-    for bar in bars:
-        height = bar.get_height()
-        ax.text(bar.get_x() + bar.get_width()/2, height + 0.5, f'{int(height)}',
-                ha='center', va='bottom', fontproperties=font_prop, fontsize=10)
+        for bar in bars:
+            height = bar.get_height()
+            ax.text(bar.get_x() + bar.get_width()/2, height + 0.5, f'{int(height)}',
+                    ha='center', va='bottom', fontproperties=font_prop, fontsize=10)
 
-    ax.set_title(reshape_farsi("تعداد مشتریان در وضعیت‌های زمانی"), fontproperties=font_prop, fontsize=14)
-    ax.set_ylabel(reshape_farsi("تعداد"), fontproperties=font_prop)
-    ax.set_xlabel(reshape_farsi("وضعیت زمانی"), fontproperties=font_prop)
+        ax.set_title(_TITLE_BAR, fontproperties=font_prop, fontsize=14)
+        ax.set_ylabel(_YLABEL_BAR, fontproperties=font_prop)
+        ax.set_xlabel(_XLABEL_BAR, fontproperties=font_prop)
 
-    plt.tight_layout()
+        _FIG_BAR.tight_layout()
 
-    buf = io.BytesIO()
-    plt.savefig(buf, format='png')
+        buf = io.BytesIO()
+        _FIG_BAR.savefig(buf, format='png', pil_kwargs=_PNG_SAVE_OPTS)
     buf.seek(0)
-    plt.close()
     return buf
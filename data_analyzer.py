@@ -1,19 +1,14 @@
 # data_analyzer.py
 import pandas as pd
+import numpy as np
 from datetime import datetime
 import jdatetime # Import jdatetime for Shamsi date conversion 📝
-from sklearn.cluster import KMeans
-from sklearn.preprocessing import StandardScaler
-import warnings
 import logging # Import logging module 📝
 
 # Setup a logger for this module
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO) # Set logging level for this module
 
-# Suppress KMeans warning for n_init in older scikit-learn versions 🤫
-warnings.filterwarnings("ignore", category=UserWarning, module="sklearn.cluster._kmeans")
-
 def convert_shamsi_to_gregorian(shamsi_date_str):
     """
     Converts a Shamsi date string (e.g., '1404-03-17') to a Gregorian datetime object.
@@ -29,9 +24,94 @@ def convert_shamsi_to_gregorian(shamsi_date_str):
         g_date = jdatetime.date(j_year, j_month, j_day).togregorian()
         return datetime(g_date.year, g_date.month, g_date.day)
     except Exception as e:
-        logger.warning(f"Failed to convert Shamsi date '{shamsi_date_str}' to Gregorian: {e}")
+        logger.warning("Failed to convert Shamsi date '%s' to Gregorian: %s", shamsi_date_str, e)
         return pd.NaT # Return Not a Time if conversion fails
 
+# Pattern for well-formed Shamsi date strings like '1404-03-17' 🗓️
+_SHAMSI_DATE_PATTERN = r'^\d{4}-\d{1,2}-\d{1,2}$'
+
+def shamsi_to_gregorian_vec(jy, jm, jd):
+    """
+    Vectorized Shamsi→Gregorian conversion over integer NumPy arrays. ⚡
+
+    Uses the closed-form 33-year cycle arithmetic on whole arrays instead of
+    creating one jdatetime object per row, returning a datetime64[D] array
+    in a single pass.
+    """
+    jy = jy + 1595
+    days = (-355668 + 365 * jy + (jy // 33) * 8 + ((jy % 33 + 3) // 4) + jd
+            + np.where(jm < 7, (jm - 1) * 31, (jm - 7) * 30 + 186))
+    # Unroll the Gregorian 400/100/4-year cycle corrections on whole arrays.
+    gy = 400 * (days // 146097)
+    days = days % 146097
+    over = days > 36524
+    days = np.where(over, days - 1, days)
+    gy += np.where(over, 100 * (days // 36524), 0)
+    days = np.where(over, days % 36524, days)
+    days = np.where(over & (days >= 365), days + 1, days)
+    gy += 4 * (days // 1461)
+    days = days % 1461
+    extra = days > 365
+    gy += np.where(extra, (days - 1) // 365, 0)
+    doy = np.where(extra, (days - 1) % 365, days)  # zero-based day of Gregorian year
+    year_start = (gy - 1970).astype('datetime64[Y]').astype('datetime64[D]')
+    return year_start + doy.astype('timedelta64[D]')
+
+def _parse_shamsi_column(shamsi_series):
+    """
+    Converts a Series of Shamsi date strings to Gregorian datetimes in bulk. 📊
+    Malformed or out-of-range values become NaT, mirroring the scalar helper.
+    """
+    date_str = shamsi_series.astype(str)
+    valid = date_str.str.match(_SHAMSI_DATE_PATTERN).to_numpy()
+    parts = date_str.where(valid, '1-1-1').str.split('-', expand=True).astype('int32')
+    jy, jm, jd = (parts[c].to_numpy() for c in (0, 1, 2))
+    # Per-month day caps so impossible dates become NaT instead of rolling
+    # over: months 1-6 have 31 days, 7-11 have 30, Esfand 29 (30 in leap
+    # years — leap flag taken from the same 33-year cycle as the conversion)
+    y = jy + 1595
+    leap = (((y + 1) // 33) * 8 + ((y + 1) % 33 + 3) // 4
+            - (y // 33) * 8 - (y % 33 + 3) // 4) == 1
+    month_days = np.where(jm <= 6, 31, np.where(jm <= 11, 30, np.where(leap, 30, 29)))
+    valid &= (jm >= 1) & (jm <= 12) & (jd >= 1) & (jd <= month_days)
+    greg = shamsi_to_gregorian_vec(jy, jm, jd)
+    return pd.Series(greg, index=shamsi_series.index).where(valid)
+
+# Cumulative days before each Gregorian month (non-leap years)
+_G_DAYS_IN_MONTH = np.array([0, 31, 59, 90, 120, 151, 181, 212, 243, 273, 304, 334])
+
+def gregorian_to_shamsi_vec(dt64_arr):
+    """
+    Converts an array of Gregorian datetimes to Shamsi 'YYYY-MM-DD' strings
+    in bulk, inverting the cycle arithmetic of shamsi_to_gregorian_vec.
+    NaT entries come back as 'N/A'.
+    """
+    idx = pd.DatetimeIndex(dt64_arr)
+    mask = idx.notna()
+    gy = np.where(mask, idx.year, 2000).astype('int64')
+    gm = np.where(mask, idx.month, 1).astype('int64')
+    gd = np.where(mask, idx.day, 1).astype('int64')
+
+    gy2 = np.where(gm > 2, gy + 1, gy)
+    days = (355666 + 365 * gy + (gy2 + 3) // 4 - (gy2 + 99) // 100
+            + (gy2 + 399) // 400 + gd + _G_DAYS_IN_MONTH[gm - 1])
+    jy = -1595 + 33 * (days // 12053)
+    days = days % 12053
+    jy += 4 * (days // 1461)
+    days = days % 1461
+    extra = days > 365
+    jy += np.where(extra, (days - 1) // 365, 0)
+    days = np.where(extra, (days - 1) % 365, days)
+    first_half = days < 186
+    jm = np.where(first_half, 1 + days // 31, 7 + (days - 186) // 30)
+    jd = np.where(first_half, 1 + days % 31, 1 + (days - 186) % 30)
+
+    out = np.char.add(np.char.add(
+        np.char.zfill(jy.astype('U4'), 4), '-'), np.char.add(
+        np.char.zfill(jm.astype('U2'), 2), '-'))
+    out = np.char.add(out, np.char.zfill(jd.astype('U2'), 2))
+    return np.where(mask, out, 'N/A')
+
 def convert_gregorian_to_shamsi_str(gregorian_date_obj):
     """
     Converts a Gregorian datetime object to a Shamsi date string (YYYY-MM-DD).
@@ -43,7 +123,7 @@ def convert_gregorian_to_shamsi_str(gregorian_date_obj):
         j_date = jdatetime.date.fromgregorian(gregorian_date_obj.year, gregorian_date_obj.month, gregorian_date_obj.day)
         return j_date.strftime("%Y-%m-%d")
     except Exception as e:
-        logger.warning(f"Failed to convert Gregorian date '{gregorian_date_obj}' to Shamsi: {e}")
+        logger.warning("Failed to convert Gregorian date '%s' to Shamsi: %s", gregorian_date_obj, e)
         return 'N/A'
 
 
@@ -57,157 +137,141 @@ def calculate_rfm(df_transactions):
                                        با ستون‌های 'شناسه مشتری', 'تاریخ فاکتور', 'مبلغ (تومان)'. 📈
 
     Returns:
-        pd.DataFrame: A DataFrame with 'شناسه مشتری', 'Recency', 'Frequency', 'Monetary' columns.
+        pd.DataFrame: A DataFrame with 'CustomerID', 'Recency', 'Frequency', 'Monetary'
+                      and the R/F/M score columns (scoring is fused into the same pass).
                       Returns an empty DataFrame if input is empty or dates are invalid. 🚫
     """
     if df_transactions.empty:
         logger.info("df_transactions is empty in calculate_rfm.")
         return pd.DataFrame()
 
-    # Convert 'تاریخ فاکتور' (Shamsi) to Gregorian datetime objects 🗓️
-    df_transactions['تاریخ فاکتور_greg'] = df_transactions['تاریخ فاکتور'].apply(convert_shamsi_to_gregorian)
+    # Convert 'تاریخ فاکتور' (Shamsi) to Gregorian datetime objects in one vectorized pass 🗓️
+    greg_dates = _parse_shamsi_column(df_transactions['تاریخ فاکتور'])
 
-    # Drop rows where date conversion resulted in NaT (Not a Time)
-    df_transactions.dropna(subset=['تاریخ فاکتور_greg'], inplace=True) 
-
-    if df_transactions['تاریخ فاکتور_greg'].empty:
-        logger.info("After Shamsi date cleaning, df_transactions['تاریخ فاکتور_greg'] is empty. No valid transactions for RFM.")
+    # Keep only rows whose date converted cleanly, in a local frame so the
+    # caller's DataFrame is never mutated (no added column, no dropped rows).
+    mask = greg_dates.notna().to_numpy()
+    if not mask.any():
+        logger.info("After Shamsi date cleaning, no valid transactions remain for RFM.")
         return pd.DataFrame() # No valid transactions to calculate RFM 🤷‍♂️
 
+    valid = pd.DataFrame({
+        'شناسه مشتری': df_transactions['شناسه مشتری'].to_numpy()[mask],
+        'تاریخ فاکتور_greg': greg_dates.to_numpy()[mask],
+        'شماره فاکتور': df_transactions['شماره فاکتور'].to_numpy()[mask],
+        'مبلغ (تومان)': df_transactions['مبلغ (تومان)'].to_numpy()[mask],
+    })
+
     # Define a snapshot date as the day after the last transaction date (Gregorian) 🗓️
-    snapshot_date = df_transactions['تاریخ فاکتور_greg'].max() + pd.Timedelta(days=1)
-    
-    # Calculate RFM components ➕
-    rfm_df = df_transactions.groupby('شناسه مشتری').agg(
-        Recency=('تاریخ فاکتور_greg', lambda date: (snapshot_date - date.max()).days), # Days since last purchase ⏰
-        Frequency=('شماره فاکتور', 'count'), # Count of transactions 🔢
+    snapshot_date = valid['تاریخ فاکتور_greg'].max() + pd.Timedelta(days=1)
+
+    # Calculate RFM components in a single Cython-backed groupby pass ➕
+    # ('size' instead of 'count' skips per-column NaN checks, and the Recency
+    # subtraction happens vectorized on the grouped result instead of in a
+    # per-group Python lambda.)
+    rfm_df = valid.groupby('شناسه مشتری', sort=False).agg(
+        LastDate=('تاریخ فاکتور_greg', 'max'), # Date of last purchase ⏰
+        Frequency=('شماره فاکتور', 'size'), # Count of transactions 🔢
         Monetary=('مبلغ (تومان)', 'sum') # Total spending 💲
     ).reset_index()
+    rfm_df['Recency'] = (snapshot_date - rfm_df['LastDate']).dt.days.astype('int32') # Days since last purchase ⏰
+    rfm_df.drop(columns=['LastDate'], inplace=True)
 
     # Rename 'شناسه مشتری' to 'CustomerID' for consistency with RFM definitions
     rfm_df.rename(columns={'شناسه مشتری': 'CustomerID'}, inplace=True)
-    logger.info(f"RFM Calculated DataFrame (first 5 rows):\n{rfm_df.head().to_string()}")
+
+    # Score R/F/M in the same pass — the grouped arrays are already in cache,
+    # so quantile binning here avoids re-scanning the frame in a second stage
+    rfm_df['R_Score'] = _quantile_scores(rfm_df['Recency'].to_numpy(), is_recency=True)
+    rfm_df['F_Score'] = _quantile_scores(rfm_df['Frequency'].to_numpy())
+    rfm_df['M_Score'] = _quantile_scores(rfm_df['Monetary'].to_numpy())
+
+    logger.info("RFM Calculated+Scored DataFrame (first 5 rows):\n%s", rfm_df.head().to_string())
     return rfm_df
 
-def calculate_rfm_scores(rfm_df):
+def _quantile_scores(vals, is_recency=False):
     """
-    Calculates R, F, M scores (1-5) based on RFM values using quintiles. 
-    Higher Recency = lower R score (inverse). Higher Frequency/Monetary = higher F/M score.
+    Bins a numeric array into up to 5 quintile scores (1-5) via one quantile
+    computation + one searchsorted. Higher Recency = lower score (inverse);
+    higher Frequency/Monetary = higher score.
     """
-    if rfm_df.empty:
-        logger.info("rfm_df is empty in calculate_rfm_scores.")
-        return rfm_df
-
-    for col_name, score_col_name, is_recency in [('Recency', 'R_Score', True), 
-                                                 ('Frequency', 'F_Score', False), 
-                                                 ('Monetary', 'M_Score', False)]:
-        
-        # Ensure the column is numeric before checking unique values
-        if not pd.api.types.is_numeric_dtype(rfm_df[col_name]):
-            logger.warning(f"Column '{col_name}' is NOT numeric. Type: {rfm_df[col_name].dtype}. Skipping scoring for this column.")
-            rfm_df[score_col_name] = 0 # Assign a default score if not numeric
-            continue
-        
-        num_unique_values = rfm_df[col_name].nunique()
-        
-        # Handle cases with very few unique values to avoid qcut errors
-        if num_unique_values == 0:
-            rfm_df[score_col_name] = 0 # No data, assign 0
-            logger.info(f"Column '{col_name}' has 0 unique values. Assigned score 0.")
-        elif num_unique_values == 1:
-            if is_recency:
-                # If only one Recency value, and it's very recent, give high score
-                rfm_df[score_col_name] = 5 if rfm_df[col_name].iloc[0] <= 30 else 1 
-                logger.info(f"Column '{col_name}' has 1 unique value. Assigned R_Score based on heuristic.")
-            else:
-                rfm_df[score_col_name] = 3 # Assign mid-score for F/M if no variance
-                logger.info(f"Column '{col_name}' has 1 unique value. Assigned {col_name[0]}_Score=3.")
+    n_bins = min(5, np.unique(vals).size)
+    if n_bins == 0:
+        return np.zeros(0, dtype='int8')
+    if n_bins == 1:
+        # No variance: heuristic for Recency, mid-score for F/M
+        if is_recency:
+            fill = 5 if vals[0] <= 30 else 1
         else:
-            # For 2 to 5 unique values, use num_unique_values as n_bins to avoid errors
-            # For > 5 unique values, use 5 bins
-            n_bins = min(5, num_unique_values)
-            
-            # Labels for qcut: Recency is inverse, F/M are direct
-            if is_recency:
-                labels = range(n_bins, 0, -1) # e.g., [5,4,3,2,1] for 5 bins
-            else:
-                labels = range(1, n_bins + 1) # e.g., [1,2,3,4,5] for 5 bins
-            
-            try:
-                # Ensure labels length matches n_bins
-                rfm_df[score_col_name] = pd.qcut(rfm_df[col_name], n_bins, labels=list(labels), duplicates='drop')
-                logger.info(f"Assigned {score_col_name} via qcut with {n_bins} bins.")
-            except Exception as e:
-                logger.error(f"Error in pd.qcut for column '{col_name}' with {n_bins} bins: {e}. Assigning default score.")
-                if is_recency:
-                    rfm_df[score_col_name] = 5 if rfm_df[col_name].iloc[0] <= 30 else 1
-                else:
-                    rfm_df[score_col_name] = 3
-        
-    # Convert to int for cleaner display, handling potential non-numeric values gracefully
-    for score_col in ['R_Score', 'F_Score', 'M_Score']:
-        # Ensure the column exists before converting, default to 0 if not
-        if score_col not in rfm_df.columns:
-            logger.warning(f"Score column '{score_col}' was NOT created. Defaulting to 0.")
-            rfm_df[score_col] = 0 
-        else:
-            logger.info(f"Score column '{score_col}' found. Type: {rfm_df[score_col].dtype}")
-        rfm_df[score_col] = rfm_df[score_col].astype(int)
-
-    logger.info(f"RFM Scored DataFrame (final first 5 rows):\n{rfm_df.head().to_string()}")
-    return rfm_df
-
-def determine_tam_status(recency_days):
+            fill = 3
+        return np.full(vals.size, fill, dtype='int8')
+
+    # Quintile binning without pd.qcut: skips qcut's sort + Categorical
+    # machinery. side='left' keeps values equal to an edge in the lower
+    # bucket, matching qcut's right-closed intervals.
+    edges = np.unique(np.quantile(vals, np.linspace(0, 1, n_bins + 1)[1:-1]))
+    scores = np.searchsorted(edges, vals, side='left') + 1
+    if is_recency:
+        # Recency is inverse: most recent bucket gets the highest score
+        scores = len(edges) + 2 - scores
+    return scores.astype('int8')
+
+# TAM recency bucket edges (in days) and their labels: <=30 Active, <=90 At Risk,
+# <=180 Inactive, anything beyond is Lost.
+_TAM_BINS = np.array([30, 90, 180])
+_TAM_LABELS = np.array(['Active', 'At Risk', 'Inactive', 'Lost'])
+
+# Fixed category sets for the label columns (includes the no-transaction fills)
+_TAM_CATEGORIES = ['Active', 'At Risk', 'Inactive', 'Lost', 'No Purchase']
+_SEGMENT_CATEGORIES = ['ویژه', 'وفادار', 'امید بخش', 'در خطر',
+                       'غیر فعال', 'از دست رفته', 'معمولی', 'فاقد تراکنش']
+
+def determine_tam_statuses(recency_days):
     """
-    Determines the TAM (Temporal Activity Model) status based on Recency in days.
+    Determines the TAM (Temporal Activity Model) status for a whole array of
+    Recency values in days, via a single searchsorted pass in C.
     """
-    if recency_days <= 30:
-        return 'Active'
-    elif recency_days <= 90:
-        return 'At Risk'
-    elif recency_days <= 180:
-        return 'Inactive'
-    else:
-        return 'Lost'
-
-def assign_segment(row):
+    return _TAM_LABELS[np.searchsorted(_TAM_BINS, np.asarray(recency_days))]
+
+def assign_segments(rfm_df_scored):
     """
-    Assigns the final customer segment based on RFM scores and TAM status.
+    Assigns the final customer segment for all rows at once based on RFM scores
+    and TAM status, using np.select over boolean arrays instead of a row-wise apply.
     """
-    R, F, M = row['R_Score'], row['F_Score'], row['M_Score']
-    tam_status = row['TAM_Status']
-
-    if R >= 4 and F >= 4 and M >= 4 and tam_status == 'Active':
-        return "ویژه" # Special/Champion
-    elif R == 5 and F >= 3 and tam_status == 'Active':
-        return "وفادار" # Loyal
-    elif R >= 4 and F <= 2 and tam_status == 'Active':
-        return "امید بخش" # Promising
-    elif tam_status == 'At Risk' and (F >= 3 or M >= 3):
-        return "در خطر" # At Risk
-    elif tam_status == 'Inactive':
-        return "غیر فعال" # Inactive
-    elif tam_status == 'Lost' and F == 1 and M == 1:
-        return "از دست رفته" # Lost
-    else:
-        return "معمولی" # Regular/Normal
+    R = rfm_df_scored['R_Score'].to_numpy()
+    F = rfm_df_scored['F_Score'].to_numpy()
+    M = rfm_df_scored['M_Score'].to_numpy()
+    T = rfm_df_scored['TAM_Status'].to_numpy()
+
+    conditions = [
+        (R >= 4) & (F >= 4) & (M >= 4) & (T == 'Active'),
+        (R == 5) & (F >= 3) & (T == 'Active'),
+        (R >= 4) & (F <= 2) & (T == 'Active'),
+        (T == 'At Risk') & ((F >= 3) | (M >= 3)),
+        T == 'Inactive',
+        (T == 'Lost') & (F == 1) & (M == 1),
+    ]
+    choices = [
+        "ویژه", # Special/Champion
+        "وفادار", # Loyal
+        "امید بخش", # Promising
+        "در خطر", # At Risk
+        "غیر فعال", # Inactive
+        "از دست رفته", # Lost
+    ]
+    return np.select(conditions, choices, default="معمولی") # Regular/Normal
 
 def get_full_customer_segments_df(df_transactions, df_customers):
     """
     Performs comprehensive customer segmentation using RFM and TAM models.
     Returns a DataFrame with each customer's details and their assigned segment.
     """
-    # Keep a copy of original df_customers to retrieve original 'تاریخ عضویت' later
-    df_customers_original = df_customers.copy()
-
-    # Ensure 'تاریخ عضویت' in df_customers_original is treated as string for the final output
-    df_customers_original['تاریخ عضویت'] = df_customers_original['تاریخ عضویت'].astype(str)
-
     rfm_df = calculate_rfm(df_transactions)
-    
+
     if rfm_df.empty:
         logger.warning("RFM DataFrame is empty after calculation. All customers will be 'فاقد تراکنش'.")
-        final_df_no_transactions = df_customers_original.copy() # Use original customer data
+        final_df_no_transactions = df_customers.copy() # Use original customer data
+        final_df_no_transactions['تاریخ عضویت'] = final_df_no_transactions['تاریخ عضویت'].astype(str)
         final_df_no_transactions['روز از آخرین خرید'] = -1 # Indicates no recent purchase
         final_df_no_transactions['تعداد خرید'] = 0
         final_df_no_transactions['مجموع خرید'] = 0
@@ -227,26 +291,30 @@ def get_full_customer_segments_df(df_transactions, df_customers):
         ]
         final_df_no_transactions = final_df_no_transactions[[col for col in desired_order_no_txn if col in final_df_no_transactions.columns]]
 
-        logger.info(f"Full Segmented DataFrame (all 'فاقد تراکنش' due to no transactions):\n{final_df_no_transactions.head().to_string()}")
-        logger.info(f"Segment Distribution:\n{final_df_no_transactions['دسته رفتاری نهایی'].value_counts().to_string()}")
+        logger.info("Full Segmented DataFrame (all 'فاقد تراکنش' due to no transactions):\n%s", final_df_no_transactions.head().to_string())
+        logger.info("Segment Distribution:\n%s", final_df_no_transactions['دسته رفتاری نهایی'].value_counts().to_string())
         return final_df_no_transactions
 
 
-    rfm_df_scored = calculate_rfm_scores(rfm_df)
-    if rfm_df_scored.empty:
-        logger.warning("RFM Scored DataFrame is empty after scoring.")
-        return pd.DataFrame() # Should not happen if rfm_df is not empty
+    # Scores are computed inside calculate_rfm in the same pass as the agg
+    rfm_df_scored = rfm_df
 
-    rfm_df_scored['TAM_Status'] = rfm_df_scored['Recency'].apply(determine_tam_status)
-    rfm_df_scored['Segment'] = rfm_df_scored.apply(assign_segment, axis=1)
+    # Low-cardinality label columns as Categorical: integer-coded storage,
+    # cheaper downstream value_counts/groupby 🗂️
+    rfm_df_scored['TAM_Status'] = pd.Categorical(
+        determine_tam_statuses(rfm_df_scored['Recency'].to_numpy()),
+        categories=_TAM_CATEGORIES)
+    rfm_df_scored['Segment'] = pd.Categorical(
+        assign_segments(rfm_df_scored), categories=_SEGMENT_CATEGORIES)
 
     # Calculate LastPurchase as Gregorian datetime object for merging/consistency
     today = datetime.now()
     rfm_df_scored['آخرین خرید_greg'] = rfm_df_scored['Recency'].apply(lambda x: (today - pd.Timedelta(days=x)))
 
     # Merge with original customer details to retain original 'تاریخ عضویت'
+    # (merge builds a fresh frame, so no upfront copy of df_customers is needed)
     final_df = pd.merge(
-        df_customers_original, # Merge with the original customer data
+        df_customers, # Merge with the original customer data
         rfm_df_scored[[
             'CustomerID', 'Recency', 'Frequency', 'Monetary',
             'R_Score', 'F_Score', 'M_Score', 'TAM_Status', 'Segment',
@@ -257,19 +325,23 @@ def get_full_customer_segments_df(df_transactions, df_customers):
         how='left'
     )
 
-    # Fill NaN values for customers who might not have transactions
-    final_df['Recency'].fillna(-1, inplace=True) 
-    final_df['Frequency'].fillna(0, inplace=True)
-    final_df['Monetary'].fillna(0, inplace=True)
-    final_df['R_Score'].fillna(0, inplace=True)
-    final_df['F_Score'].fillna(0, inplace=True)
-    final_df['M_Score'].fillna(0, inplace=True)
-    final_df['TAM_Status'].fillna('No Purchase', inplace=True) 
-    final_df['Segment'].fillna('فاقد تراکنش', inplace=True)
-    final_df['آخرین خرید_greg'].fillna(pd.NaT, inplace=True) # Fill with NaT for consistency before Shamsi conversion
-
-    # Convert 'آخرین خرید_greg' to Shamsi string for final output
-    final_df['آخرین خرید'] = final_df['آخرین خرید_greg'].apply(convert_gregorian_to_shamsi_str)
+    # Fill NaN values for customers who might not have transactions —
+    # one fillna pass instead of eight chained inplace calls
+    # ('آخرین خرید_greg' keeps its NaT for the Shamsi conversion below)
+    final_df = final_df.fillna({
+        'Recency': -1, 'Frequency': 0, 'Monetary': 0,
+        'R_Score': 0, 'F_Score': 0, 'M_Score': 0,
+        'TAM_Status': 'No Purchase', 'Segment': 'فاقد تراکنش',
+    })
+    # Merging introduced NaNs and upcast the numerics to float64; bring them
+    # back to compact integer dtypes now that the gaps are filled
+    final_df = final_df.astype({
+        'Recency': 'int32', 'Frequency': 'int32', 'Monetary': 'int64',
+        'R_Score': 'int8', 'F_Score': 'int8', 'M_Score': 'int8',
+    }, errors='ignore')
+
+    # Convert 'آخرین خرید_greg' to Shamsi strings in one vectorized pass
+    final_df['آخرین خرید'] = gregorian_to_shamsi_vec(final_df['آخرین خرید_greg'].to_numpy())
     final_df.drop(columns=['آخرین خرید_greg'], inplace=True) # Drop the temporary Gregorian column
 
     # Drop the redundant 'CustomerID' column from merge
@@ -298,9 +370,12 @@ def get_full_customer_segments_df(df_transactions, df_customers):
     ]
     final_df = final_df[[col for col in desired_order if col in final_df.columns]]
 
+    # Cast membership date to string for display only at output time
+    if final_df['تاریخ عضویت'].dtype != object:
+        final_df['تاریخ عضویت'] = final_df['تاریخ عضویت'].astype(str)
 
-    logger.info(f"Full Segmented DataFrame (first 5 rows with scores and segment):\n{final_df.head().to_string()}")
-    logger.info(f"Segment Distribution:\n{final_df['دسته رفتاری نهایی'].value_counts().to_string()}")
+    logger.info("Full Segmented DataFrame (first 5 rows with scores and segment):\n%s", final_df.head().to_string())
+    logger.info("Segment Distribution:\n%s", final_df['دسته رفتاری نهایی'].value_counts().to_string())
 
     return final_df
 
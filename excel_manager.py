@@ -1,10 +1,21 @@
 # excel_manager.py
 import pandas as pd
+import xlsxwriter
 from openpyxl import load_workbook, Workbook
 from datetime import datetime # Using standard datetime for Gregorian dates 🗓️
+import io
 import os
+import re
+import threading
 import jdatetime
 
+# openpyxl silently falls back to the slow stdlib XML path without lxml;
+# warn once so a missing wheel doesn't go unnoticed 🐢
+try:
+    import lxml  # noqa: F401
+except ImportError:
+    print("Warning: lxml is not installed; openpyxl will use the slower stdlib XML serializer. ⚠️")
+
 def create_initial_excel(file_path):
     """
     Creates a new Excel file with 'Customers', 'Transactions', and 'Form' sheets
@@ -29,8 +40,139 @@ def create_initial_excel(file_path):
         # ws_form = wb.create_sheet("Form")
         # ws_form.append(["نام مشتری", "کد مشتری", "شماره تماس", "تاریخ فاکتور", "شماره فاکتور", "مبلغ (تومان)"])
 
+        # Hidden Meta sheet keeps the last-used ID counters so saves don't
+        # rescan whole columns (A1 = last customer no, A2 = last invoice no) 🔢
+        ws_meta = wb.create_sheet("Meta")
+        ws_meta["A1"] = 0
+        ws_meta["A2"] = 0
+        ws_meta.sheet_state = "hidden"
+
         wb.save(file_path)
         print(f"Initial Excel file created at {file_path} ✨")
+    _known_excel_paths.add(file_path)
+
+# Paths we have already seen on disk, so hot commands skip a stat() per update 🧠
+_known_excel_paths = set()
+
+def excel_file_exists(file_path):
+    """
+    Checks whether the user's Excel file exists, remembering positive answers. ✅
+    Once a file is seen (or created by us) we stop stat()-ing it on every command;
+    bot-managed files are never deleted out from under us.
+    """
+    if file_path in _known_excel_paths:
+        return True
+    if os.path.exists(file_path):
+        _known_excel_paths.add(file_path)
+        return True
+    return False
+
+# Compiled once; anchored so 'C12x' or stray prefixes never sneak through 🔢
+_ID_PATTERNS = {
+    "C": re.compile(r"^C(\d+)$"),
+    "INV": re.compile(r"^INV(\d+)$"),
+}
+
+def _max_numeric_suffix(series, prefix):
+    """
+    Returns the largest numeric suffix among values like '<prefix>123'.
+    Invalid values (wrong prefix or non-numeric) are ignored. 🔢
+    """
+    pattern = _ID_PATTERNS.get(prefix) or re.compile(rf"^{re.escape(prefix)}(\d+)$")
+    nums = pd.to_numeric(series.astype("string").str.extract(pattern, expand=False),
+                         errors="coerce")
+    return int(nums.max()) if nums.notna().any() else 0
+
+# In-process counter cache: file_path -> [last_customer_n, last_invoice_n, mtime].
+# Skips even the Meta-sheet read on repeated saves within one run; an mtime
+# change (external edit / import rewrite) invalidates the entry. 🧠
+_id_cache = {}
+_id_cache_lock = threading.Lock()
+
+def _file_mtime(file_path):
+    try:
+        return os.stat(file_path).st_mtime
+    except OSError:
+        return -1.0
+
+def _id_cache_entry(file_path, wb):
+    """Returns the (mutable) cached counter entry for file_path, reseeding from Meta if stale."""
+    mtime = _file_mtime(file_path)
+    entry = _id_cache.get(file_path)
+    if entry is None or entry[2] != mtime:
+        ws_meta = _get_meta_sheet(wb)
+        entry = [int(ws_meta["A1"].value or 0), int(ws_meta["A2"].value or 0), mtime]
+        _id_cache[file_path] = entry
+    return entry
+
+def _take_next_customer_num(file_path, wb):
+    """Bumps and returns the next customer number, keeping cache and Meta sheet in sync."""
+    with _id_cache_lock:
+        entry = _id_cache_entry(file_path, wb)
+        entry[0] += 1
+        n = entry[0]
+    _get_meta_sheet(wb)["A1"] = n
+    return n
+
+def _take_next_invoice_num(file_path, wb):
+    """Bumps and returns the next invoice number, keeping cache and Meta sheet in sync."""
+    with _id_cache_lock:
+        entry = _id_cache_entry(file_path, wb)
+        entry[1] += 1
+        n = entry[1]
+    _get_meta_sheet(wb)["A2"] = n
+    return n
+
+# Phone index cache: file_path -> (dict phone -> (row_idx, customer_id), mtime).
+# Turns the per-save linear scan of the Customers sheet into one dict lookup. 📇
+_phone_cache = {}
+_phone_cache_lock = threading.Lock()
+
+def _phone_index(file_path, wb):
+    """
+    Returns the phone -> (row_idx, customer_id) index for the Customers sheet,
+    rebuilt whenever the file's mtime changes (external edits, imports).
+    """
+    mtime = _file_mtime(file_path)
+    with _phone_cache_lock:
+        entry = _phone_cache.get(file_path)
+        if entry is None or entry[1] != mtime:
+            index = {}
+            for row_idx, row in enumerate(wb["Customers"].iter_rows(min_row=2, max_col=3, values_only=True), start=2):
+                if row[2] is not None and row[2] not in index:
+                    index[row[2]] = (row_idx, row[0])
+            entry = (index, mtime)
+            _phone_cache[file_path] = entry
+        return entry[0]
+
+def _touch_id_cache(file_path):
+    """Re-stamps the cached mtimes after our own save so the caches stay warm."""
+    _known_excel_paths.add(file_path)
+    mtime = _file_mtime(file_path)
+    with _id_cache_lock:
+        entry = _id_cache.get(file_path)
+        if entry is not None:
+            entry[2] = mtime
+    with _phone_cache_lock:
+        entry = _phone_cache.get(file_path)
+        if entry is not None:
+            _phone_cache[file_path] = (entry[0], mtime)
+
+def _get_meta_sheet(wb):
+    """
+    Returns the hidden 'Meta' counter sheet, rebuilding it with a one-time
+    column scan if the workbook predates it (or lost it on rewrite). 🛠️
+    """
+    if "Meta" in wb.sheetnames:
+        return wb["Meta"]
+
+    ws_meta = wb.create_sheet("Meta")
+    ws_meta.sheet_state = "hidden"
+    ids = pd.Series([row[0] for row in wb["Customers"].iter_rows(min_row=2, max_col=1, values_only=True)])
+    invs = pd.Series([row[0] for row in wb["Transactions"].iter_rows(min_row=2, min_col=3, max_col=3, values_only=True)])
+    ws_meta["A1"] = _max_numeric_suffix(ids, "C") if not ids.empty else 0
+    ws_meta["A2"] = _max_numeric_suffix(invs, "INV") if not invs.empty else 0
+    return ws_meta
 
 def get_next_customer_id(df_customers):
     """
@@ -40,18 +182,7 @@ def get_next_customer_id(df_customers):
     if df_customers.empty:
         return "C001"
     else:
-        # Extract numerical part, convert to int, find max, then format 🔢
-        # Handle cases where 'کد مشتری' might not start with 'C' or might be non-numeric
-        max_id = 0
-        for customer_id in df_customers["کد مشتری"]:
-            if isinstance(customer_id, str) and customer_id.startswith('C'):
-                try:
-                    num_part = int(customer_id[1:])
-                    if num_part > max_id:
-                        max_id = num_part
-                except ValueError:
-                    # Ignore invalid customer IDs 🚫
-                    pass
+        max_id = _max_numeric_suffix(df_customers["کد مشتری"], "C")
         return f"C{max_id + 1:03d}" # Format to ensure leading zeros (e.g., C001) ➡️
 
 def get_next_invoice_number(df_transactions):
@@ -62,17 +193,7 @@ def get_next_invoice_number(df_transactions):
     if df_transactions.empty:
         return "INV001"
     else:
-        # Extract numerical part, convert to int, find max, then format 🔢
-        max_inv_num = 0
-        for inv_num in df_transactions["شماره فاکتور"]:
-            if isinstance(inv_num, str) and inv_num.startswith('INV'):
-                try:
-                    num_part = int(inv_num[3:])
-                    if num_part > max_inv_num:
-                        max_inv_num = num_part
-                except ValueError:
-                    # Ignore invalid invoice numbers 🚫
-                    pass
+        max_inv_num = _max_numeric_suffix(df_transactions["شماره فاکتور"], "INV")
         return f"INV{max_inv_num + 1:03d}" # Format to ensure leading zeros (e.g., INV001) ➡️
 
 def save_purchase(file_path, customer_name, customer_phone, amount):
@@ -88,46 +209,39 @@ def save_purchase(file_path, customer_name, customer_phone, amount):
         create_initial_excel(file_path) # Create if not found ➕
         wb = load_workbook(file_path) # Load again 🔄
 
+    # Today's Shamsi date, formatted once and reused for join + invoice dates 🗓️
+    today_str = jdatetime.date.today().strftime("%Y-%m-%d")
+
     # --- Update Customers Sheet 👥 ---
     ws_customers = wb["Customers"]
-    # Read existing customer data into a DataFrame for easier lookup 🔍
-    df_customers = pd.DataFrame(ws_customers.iter_rows(min_row=2, values_only=True), 
-                                columns=["کد مشتری", "نام", "شماره تماس", "تاریخ عضویت", "توضیحات"])
 
+    # Check if customer already exists by phone number — one dict lookup in
+    # the cached phone index instead of a sheet scan ✅
+    phone_index = _phone_index(file_path, wb)
+    hit = phone_index.get(customer_phone)
     customer_id = None
-    # Check if customer already exists by phone number ✅
-    existing_customer = df_customers[df_customers["شماره تماس"] == customer_phone]
-
-    if not existing_customer.empty:
-        # Customer exists, use their existing ID 👍
-        customer_id = existing_customer["کد مشتری"].iloc[0]
+    if hit is not None:
+        row_idx, customer_id = hit
         print(f"Existing customer found: {customer_id} 🧑‍🤝‍🧑")
         # Optional: Update customer name if it has changed (good practice) 🔄
-        for row_idx, row in enumerate(ws_customers.iter_rows(min_row=2), start=2):
-            if row[2].value == customer_phone: # Column C (index 2) is "شماره تماس"
-                if row[1].value != customer_name: # Column B (index 1) is "نام"
-                    ws_customers.cell(row=row_idx, column=2, value=customer_name)
-                    print(f"Updated name for customer {customer_id} to {customer_name} ✅")
-                break
-    else:
-        # New customer, generate a new ID and add to Customers sheet 🆕
-        customer_id = get_next_customer_id(df_customers)
-        # Get current date in Gregorian format YYYY/MM/DD 🗓️
-        today_date = jdatetime.date.today().strftime("%Y-%m-%d")
-        ws_customers.append([customer_id, customer_name, customer_phone, today_date, ""]) # Add empty description ➕
+        if ws_customers.cell(row=row_idx, column=2).value != customer_name: # Column B is "نام"
+            ws_customers.cell(row=row_idx, column=2, value=customer_name)
+            print(f"Updated name for customer {customer_id} to {customer_name} ✅")
+
+    if customer_id is None:
+        # New customer: O(1) read+increment of the Meta counter instead of
+        # rescanning the whole ID column 🆕
+        customer_id = f"C{_take_next_customer_num(file_path, wb):03d}"
+        ws_customers.append([customer_id, customer_name, customer_phone, today_str, ""]) # Add empty description ➕
+        phone_index[customer_phone] = (ws_customers.max_row, customer_id) # keep the index current 📇
         print(f"Added new customer: {customer_id} ({customer_name}, {customer_phone}) 🎉")
 
     # --- Update Transactions Sheet 💰 ---
     ws_transactions = wb["Transactions"]
-    # Read existing transaction data to generate the next invoice number 🔍
-    df_transactions = pd.DataFrame(ws_transactions.iter_rows(min_row=2, values_only=True), 
-                                   columns=["شناسه مشتری", "تاریخ فاکتور", "شماره فاکتور", "مبلغ (تومان)"])
+    # Next invoice number also comes from the Meta counter 🔍
+    invoice_number = f"INV{_take_next_invoice_num(file_path, wb):03d}"
 
-    invoice_number = get_next_invoice_number(df_transactions)
-    # Current date in Gregorian for invoice 🗓️
-    invoice_date = jdatetime.date.today().strftime("%Y-%m-%d")
-
-    ws_transactions.append([customer_id, invoice_date, invoice_number, amount])
+    ws_transactions.append([customer_id, today_str, invoice_number, amount])
     print(f"Added new transaction: {invoice_number} for customer {customer_id} with amount {amount} 💸")
 
     # --- Update Form Sheet (for display/mimicking original Excel behavior) 📝 ---
@@ -144,52 +258,79 @@ def save_purchase(file_path, customer_name, customer_phone, amount):
 
     # Save the entire workbook 💾
     wb.save(file_path)
+    _touch_id_cache(file_path)
     print(f"Excel file saved successfully at {file_path} ✨")
 
 
-def save_purchase_bulk(file_path, customer_name, customer_phone, amount, description=""):
+def save_purchases_bulk_many(file_path, rows):
     """
-    Saves bulk customer data into the Excel file. Handles new and existing customers.
+    Saves many purchases with a single workbook load and save. 📦
+    rows is an iterable of (customer_name, customer_phone, amount, description)
+    tuples; new and existing customers are handled like save_purchase.
+    Returns the number of transactions written.
     """
+    rows = list(rows)
+    if not rows:
+        return 0
+
     try:
         wb = load_workbook(file_path)
     except FileNotFoundError:
         create_initial_excel(file_path)
         wb = load_workbook(file_path)
 
-    # --- Customers Sheet ---
+    today_str = jdatetime.date.today().strftime("%Y-%m-%d")
     ws_customers = wb["Customers"]
-    df_customers = pd.DataFrame(ws_customers.iter_rows(min_row=2, values_only=True),
-                                columns=["کد مشتری", "نام", "شماره تماس", "تاریخ عضویت", "توضیحات"])
-
-    # Check if customer already exists
-    existing = df_customers[df_customers["شماره تماس"] == customer_phone]
-    if not existing.empty:
-        customer_id = existing["کد مشتری"].iloc[0]
-    else:
-        customer_id = get_next_customer_id(df_customers)
-        today_date = jdatetime.date.today().strftime("%Y-%m-%d")
-        ws_customers.append([customer_id, customer_name, customer_phone, today_date, description])
-
-    # --- Transactions Sheet ---
     ws_transactions = wb["Transactions"]
-    df_transactions = pd.DataFrame(ws_transactions.iter_rows(min_row=2, values_only=True),
-                                   columns=["شناسه مشتری", "تاریخ فاکتور", "شماره فاکتور", "مبلغ (تومان)"])
+    phone_index = _phone_index(file_path, wb)
 
-    invoice_number = get_next_invoice_number(df_transactions)
-    invoice_date = jdatetime.date.today().strftime("%Y-%m-%d")
-    ws_transactions.append([customer_id, invoice_date, invoice_number, amount])
+    for customer_name, customer_phone, amount, description in rows:
+        hit = phone_index.get(customer_phone)
+        if hit is not None:
+            customer_id = hit[1]
+        else:
+            customer_id = f"C{_take_next_customer_num(file_path, wb):03d}"
+            ws_customers.append([customer_id, customer_name, customer_phone, today_str, description])
+            phone_index[customer_phone] = (ws_customers.max_row, customer_id)
 
-    # Form Sheet: optional
-    # ws_form = wb["Form"]
-    # for row in ws_form.iter_rows(min_row=2, max_row=ws_form.max_row):
-    #     for cell in row:
-    #         cell.value = None
-    # ws_form.append([customer_name, customer_id, customer_phone, invoice_date, invoice_number, amount])
+        invoice_number = f"INV{_take_next_invoice_num(file_path, wb):03d}"
+        ws_transactions.append([customer_id, today_str, invoice_number, amount])
 
+    # One save amortized over the whole batch 💾
     wb.save(file_path)
+    _touch_id_cache(file_path)
+    return len(rows)
 
 
+def save_purchase_bulk(file_path, customer_name, customer_phone, amount, description=""):
+    """
+    Saves bulk customer data into the Excel file. Handles new and existing customers.
+    Single-row wrapper around save_purchases_bulk_many, kept for compatibility.
+    """
+    save_purchases_bulk_many(file_path, [(customer_name, customer_phone, amount, description)])
+
+
+# Parsed-sheet cache: (file_path, sheet_name) -> (mtime, DataFrame). Repeated
+# list/analyze commands reuse the parse until the file changes on disk. 🗄️
+_df_cache = {}
+_df_cache_lock = threading.Lock()
+
+def _read_sheet_cached(file_path, cache_key, **read_kwargs):
+    """
+    pd.read_excel with an mtime-keyed cache. Callers must treat the returned
+    frame as read-only (or copy it) since it is shared across calls.
+    """
+    key = (file_path, cache_key)
+    mtime = _file_mtime(file_path)
+    with _df_cache_lock:
+        entry = _df_cache.get(key)
+        if entry is not None and entry[0] == mtime:
+            return entry[1]
+    df = pd.read_excel(file_path, **read_kwargs)
+    with _df_cache_lock:
+        _df_cache[key] = (mtime, df)
+    return df
+
 def get_customers_data(file_path):
     """
     Reads the 'Customers' sheet from the Excel file and returns it as a pandas DataFrame. 👥
@@ -198,8 +339,12 @@ def get_customers_data(file_path):
     Returns an empty DataFrame if the file or sheet is not found, or an error occurs. 🚫
     """
     try:
-        # Read Customers sheet 🏷️
-        df_customers = pd.read_excel(file_path, sheet_name="Customers", header=0)
+        # Read Customers sheet with explicit dtypes so pandas skips per-cell
+        # type inference 🏷️ (copy: the cached frame is shared and we add columns)
+        df_customers = _read_sheet_cached(
+            file_path, "Customers", sheet_name="Customers", header=0, engine="openpyxl",
+            dtype={"کد مشتری": "string", "نام": "string",
+                   "شماره تماس": "string", "توضیحات": "string"}).copy()
     except FileNotFoundError:
         print(f"Error: Excel file not found at {file_path}. ⚠️")
         return pd.DataFrame(columns=["کد مشتری", "نام", "شماره تماس", "تاریخ عضویت", "توضیحات"])
@@ -208,44 +353,29 @@ def get_customers_data(file_path):
         return pd.DataFrame(columns=["کد مشتری", "نام", "شماره تماس", "تاریخ عضویت", "توضیحات"])
 
     try:
-        # Read Transactions sheet 💰
-        df_transactions = pd.read_excel(file_path, sheet_name="Transactions", header=0)
+        # Read Transactions sheet — only the columns the summary needs 💰
+        df_transactions = _read_sheet_cached(
+            file_path, "Transactions:summary", sheet_name="Transactions", header=0, engine="openpyxl",
+            usecols=["شناسه مشتری", "شماره فاکتور", "مبلغ (تومان)"],
+            dtype={"شناسه مشتری": "string", "شماره فاکتور": "string"})
     except Exception as e:
         print(f"Warning: Could not read Transactions sheet from {file_path}. Assuming no transactions. {e} ⚠️")
         df_transactions = pd.DataFrame(columns=["شناسه مشتری", "تاریخ فاکتور", "شماره فاکتور", "مبلغ (تومان)"])
-    
+
     # Calculate Total Transactions and Total Spend from transactions data 📈
     if not df_transactions.empty:
-        # Ensure 'مبلغ (تومان)' is numeric for sum calculation
-        df_transactions['مبلغ (تومان)'] = pd.to_numeric(df_transactions['مبلغ (تومان)'], errors='coerce').fillna(0)
-
-        customer_summary = df_transactions.groupby('شناسه مشتری').agg(
-            Total_Transactions=('شماره فاکتور', 'count'), # Count of transactions
-            Total_Spend=('مبلغ (تومان)', 'sum') # Sum of amounts
-        ).reset_index()
-        
-        # Merge this summary with the customers DataFrame
-        # 'شناسه مشتری' from transactions matches 'کد مشتری' in customers
-        df_customers = pd.merge(
-            df_customers,
-            customer_summary,
-            left_on='کد مشتری',
-            right_on='شناسه مشتری',
-            how='left'
-        )
+        # Ensure 'مبلغ (تومان)' is numeric for sum calculation — as a local
+        # series, leaving the shared cached frame untouched
+        amounts = pd.to_numeric(df_transactions['مبلغ (تومان)'], errors='coerce').fillna(0)
+
+        # One groupby pass keyed on the group index, joined straight onto the
+        # customers frame — no reset_index/merge/drop/rename chain
+        customer_summary = amounts.groupby(df_transactions['شناسه مشتری'], sort=False).agg(['count', 'sum'])
+        customer_summary.columns = ['تعداد کل تراکنش‌ها', 'مجموع مبلغ خریدها']
+
+        df_customers = df_customers.join(customer_summary, on='کد مشتری')
         # Fill NaN values for customers with no transactions
-        df_customers['Total_Transactions'].fillna(0, inplace=True)
-        df_customers['Total_Spend'].fillna(0, inplace=True)
-
-        # Drop the redundant 'شناسه مشتری' column from the merge
-        if 'شناسه مشتری' in df_customers.columns:
-            df_customers.drop(columns=['شناسه مشتری'], inplace=True)
-        
-        # Rename the new columns to Persian names as requested
-        df_customers.rename(columns={
-            'Total_Transactions': 'تعداد کل تراکنش‌ها',
-            'Total_Spend': 'مجموع مبلغ خریدها'
-        }, inplace=True)
+        df_customers = df_customers.fillna({'تعداد کل تراکنش‌ها': 0, 'مجموع مبلغ خریدها': 0})
 
     else:
         # If no transactions data, add these columns with default values (0)
@@ -261,9 +391,14 @@ def get_transactions_data(file_path):
     Returns an empty DataFrame if the file or sheet is not found, or an error occurs. 🚫
     """
     try:
-        # Use header=0 to indicate the first row is the header 🏷️
-        df = pd.read_excel(file_path, sheet_name="Transactions", header=0)
-        return df
+        # Use header=0 to indicate the first row is the header; explicit
+        # dtypes skip per-cell type inference 🏷️ (copy: cached frame is shared)
+        df = _read_sheet_cached(
+            file_path, "Transactions:full", sheet_name="Transactions", header=0,
+            engine="openpyxl",
+            dtype={"شناسه مشتری": "string", "تاریخ فاکتور": "string",
+                   "شماره فاکتور": "string"})
+        return df.copy()
     except FileNotFoundError:
         print(f"Error: Excel file not found at {file_path}. ⚠️")
         return pd.DataFrame(columns=["شناسه مشتری", "تاریخ فاکتور", "شماره فاکتور", "مبلغ (تومان)"])
@@ -271,41 +406,77 @@ def get_transactions_data(file_path):
         print(f"Error reading Transactions sheet from {file_path}: {e} ❌")
         return pd.DataFrame(columns=["شناسه مشتری", "تاریخ فاکتور", "شماره فاکتور", "مبلغ (تومان)"])
 
-def create_temp_excel_report(df: pd.DataFrame, sheet_name: str, report_type: str, data_dir: str) -> str:
+def get_all_data(file_path):
+    """
+    Returns (df_transactions, df_customers) with a single workbook open. 📖
+    When either sheet is cold in the cache, both sheets are parsed from one
+    pd.ExcelFile so the zip/shared-strings work isn't paid twice; warm
+    entries are served straight from the mtime cache.
+    """
+    mtime = _file_mtime(file_path)
+    with _df_cache_lock:
+        tx = _df_cache.get((file_path, "Transactions:full"))
+        cu = _df_cache.get((file_path, "Customers"))
+        both_warm = (tx is not None and tx[0] == mtime
+                     and cu is not None and cu[0] == mtime)
+    if not both_warm:
+        try:
+            with pd.ExcelFile(file_path, engine="openpyxl") as xls:
+                df_cu = pd.read_excel(
+                    xls, sheet_name="Customers", header=0,
+                    dtype={"کد مشتری": "string", "نام": "string",
+                           "شماره تماس": "string", "توضیحات": "string"})
+                df_tx = pd.read_excel(
+                    xls, sheet_name="Transactions", header=0,
+                    dtype={"شناسه مشتری": "string", "تاریخ فاکتور": "string",
+                           "شماره فاکتور": "string"})
+            with _df_cache_lock:
+                _df_cache[(file_path, "Customers")] = (mtime, df_cu)
+                _df_cache[(file_path, "Transactions:full")] = (mtime, df_tx)
+                # The summary view is a column subset of the full sheet 💰
+                _df_cache[(file_path, "Transactions:summary")] = (
+                    mtime, df_tx[["شناسه مشتری", "شماره فاکتور", "مبلغ (تومان)"]])
+        except Exception as e:
+            # Let the per-sheet getters produce their usual error fallbacks
+            print(f"Warning: combined read of {file_path} failed: {e} ⚠️")
+    return get_transactions_data(file_path), get_customers_data(file_path)
+
+def create_temp_excel_report(df: pd.DataFrame, sheet_name: str, report_type: str):
     """
-    Creates a temporary Excel file containing the given DataFrame in a single sheet. 📊
-    The filename includes the user ID, report type, and current date (Gregorian). 🗓️
+    Creates a one-sheet Excel report for the given DataFrame entirely in memory. 📊
+    The suggested filename includes the report type and current Shamsi date. 🗓️
 
     Args:
-        df (pd.DataFrame): The DataFrame to save to the Excel file. 📈
-        sheet_name (str): The name of the sheet in the new Excel file. 🏷️
-        user_id (int): The Telegram user ID, used for naming the file. 🆔
-        report_type (str): Type of report (e.g., "customers", "transactions") for filename. 📝
-        data_dir (str): The directory where temporary files should be stored. 📁
+        df (pd.DataFrame): The DataFrame to save to the Excel report. 📈
+        sheet_name (str): The name of the sheet in the new Excel report. 🏷️
+        report_type (str): Type of report (e.g., "customers", "transactions") for the filename. 📝
 
     Returns:
-        str: The full path to the created temporary Excel file. 📂
+        tuple[io.BytesIO, str]: The report bytes (positioned at 0) and a
+        suggested filename — nothing is written to disk. 📂
     """
-    # Use standard datetime for the date in the temporary file name 🗓️
     today_date_str = jdatetime.date.today().strftime("%Y-%m-%d")
-    # Example filename: user_data/12345_customers_2024-06-03.xlsx 📄
-    temp_file_name = f"{report_type}_{today_date_str}.xlsx"
-    temp_file_path = os.path.join(data_dir, temp_file_name)
-
-    wb = Workbook()
-    # Remove default sheet 🧹
-    if 'Sheet' in wb.sheetnames:
-        wb.remove(wb['Sheet'])
-
-    ws = wb.create_sheet(sheet_name)
-
-    # Write headers ✍️
-    ws.append(df.columns.tolist())
-    # Write data rows ➕
-    for r_idx, row in df.iterrows():
-        ws.append(row.tolist())
-
-    wb.save(temp_file_path)
-    print(f"Temporary Excel report created at: {temp_file_path} ✨")
-    return temp_file_path
+    # Example filename: customers_1404-06-03.xlsx 📄
+    file_name = f"{report_type}_{today_date_str}.xlsx"
+
+    # Drive xlsxwriter directly instead of going through pandas' cell-by-cell
+    # to_excel path — write_row on plain tuples is the fast lane, and
+    # strings_to_urls=False skips the per-string URL scan 🚀
+    buf = io.BytesIO()
+    workbook = xlsxwriter.Workbook(buf, {
+        'in_memory': True,
+        'strings_to_urls': False,
+        'nan_inf_to_errors': True,
+    })
+    worksheet = workbook.add_worksheet(sheet_name)
+    worksheet.write_row(0, 0, [str(col) for col in df.columns])
+    # pd.NA / NaT from the "string"-dtype reads can't go through write_row —
+    # map them to None (blank cell) first, same as the import save path 🧹
+    clean = df.astype(object).where(pd.notna(df), None)
+    for row_idx, row in enumerate(clean.itertuples(index=False, name=None), start=1):
+        worksheet.write_row(row_idx, 0, row)
+    workbook.close()
+    buf.seek(0)
+    print(f"In-memory Excel report created: {file_name} ✨")
+    return buf, file_name
 
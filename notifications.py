@@ -1,4 +1,5 @@
 # notifications.py
+import asyncio
 import os
 import pandas as pd
 import logging
@@ -10,6 +11,7 @@ from dotenv import load_dotenv # Import load_dotenv
 load_dotenv() # Load environment variables
 
 # Import custom modules 📚
+import excel_manager
 from user_manager import has_notification_been_sent, save_notification, get_chat_id, load_user_data
 from data_analyzer import get_full_customer_segments_df
 
@@ -28,20 +30,6 @@ if not BOT_TOKEN:
     logger.error("BOT_TOKEN environment variable not set. Notifications will not be sent.")
 
 
-def load_data_from_excel(excel_path):
-    """Loads customer and transaction data from a user's Excel file."""
-    try:
-        df_customers = pd.read_excel(excel_path, sheet_name="Customers")
-        df_transactions = pd.read_excel(excel_path, sheet_name="Transactions")
-        return df_customers, df_transactions
-    except FileNotFoundError:
-        logger.warning(f"Excel file not found at {excel_path}. Returning empty DataFrames.")
-        return pd.DataFrame(), pd.DataFrame()
-    except Exception as e:
-        logger.error(f"Error loading data from Excel file {excel_path}: {e}")
-        return pd.DataFrame(), pd.DataFrame()
-
-
 # --- Helper Functions 🛠️ ---
 def get_user_excel_path(user_id):
     """
@@ -68,39 +56,49 @@ def send_telegram_message(chat_id, text):
     try:
         response = requests.post(url, json=payload)
         response.raise_for_status() # Raise HTTPError for bad responses (4xx or 5xx)
-        logger.info(f"Message sent successfully to chat_id {chat_id}.")
+        logger.info("Message sent successfully to chat_id %s.", chat_id)
         return True
     except requests.exceptions.RequestException as e:
-        logger.error(f"Failed to send message to chat_id {chat_id}: {e}")
+        logger.error("Failed to send message to chat_id %s: %s", chat_id, e)
         return False
 
 
 # VIP Users
 async def check_and_notify_vip_after_purchase(user_id, context, chat_id):
-    logger.info(f"✅ check_and_notify_vip_after_purchase CALLED for user {user_id}")
+    """
+    Async wrapper: the whole check (Excel reads, segmentation, cooldown log
+    IO and the HTTP send) is blocking, so it runs in a worker thread instead
+    of head-of-line-blocking every other chat on the event loop. 🧵
+    """
+    await asyncio.to_thread(_check_and_notify_vip_sync, user_id, chat_id)
+
+
+def _check_and_notify_vip_sync(user_id, chat_id):
+    logger.info("✅ check_and_notify_vip_after_purchase CALLED for user %s", user_id)
 
     file_path = get_user_excel_path(user_id)
 
     if not os.path.exists(file_path):
-        logger.warning(f"Excel file for user {user_id} not found at {file_path}. Skipping VIP check.")
+        logger.warning("Excel file for user %s not found at %s. Skipping VIP check.", user_id, file_path)
         return
 
-    df_customers, df_transactions = load_data_from_excel(file_path)
+    # Cached readers: one workbook open at most, warm frames on repeat 📖
+    df_transactions, df_customers = excel_manager.get_all_data(file_path)
 
     if df_transactions.empty or df_customers.empty:
-        logger.info(f"User {user_id}: No customer or transaction data available for VIP check.")
+        logger.info("User %s: No customer or transaction data available for VIP check.", user_id)
         return
     
     # Needs enough transactions for meaningful analysis (e.g., at least 5 for KMeans to work well)
     if len(df_transactions) < 5:
-        logger.info(f"VIP check: Not enough transactions ({len(df_transactions)}) for user {user_id} for meaningful analysis. Skipping notification.")
+        logger.info("VIP check: Not enough transactions (%s) for user %s for meaningful analysis. Skipping notification.", len(df_transactions), user_id)
         return
 
     try:
         df_segmented = get_full_customer_segments_df(df_transactions, df_customers)
 
         if df_segmented.empty:
-            logger.info(f"User {user_id}: No segmented data available for VIP check.")
+            logger.info("User %s: No segmented data available for VIP check.", user_id)
             return
 
         vip_customers_to_notify = []
@@ -125,40 +123,49 @@ async def check_and_notify_vip_after_purchase(user_id, context, chat_id):
                 f"مراقب این مشتریان با ارزش باشید! 💎"
             )
             if send_telegram_message(chat_id, message):
-                logger.info(f"Consolidated VIP notification sent to {chat_id} for user {user_id}.")
+                logger.info("Consolidated VIP notification sent to %s for user %s.", chat_id, user_id)
             else:
-                logger.error(f"Failed to send consolidated VIP notification to {chat_id} for user {user_id}.")
+                logger.error("Failed to send consolidated VIP notification to %s for user %s.", chat_id, user_id)
         else:
-            logger.info(f"User {user_id}: No new VIP customers to notify after considering cooldown.")
+            logger.info("User %s: No new VIP customers to notify after considering cooldown.", user_id)
 
     except Exception as e:
-        logger.error(f"Error during VIP notification check for user {user_id}: {e}")
+        logger.error("Error during VIP notification check for user %s: %s", user_id, e)
 
 # At-Risk Users
 async def check_and_notify_at_risk_customers(user_id, context, chat_id):
-    logger.info(f"⚠️ check_and_notify_at_risk_customers CALLED for user {user_id}")
+    """
+    Async wrapper around the blocking at-risk check — same threading story
+    as the VIP path. 🧵
+    """
+    await asyncio.to_thread(_check_and_notify_at_risk_sync, user_id, chat_id)
+
+
+def _check_and_notify_at_risk_sync(user_id, chat_id):
+    logger.info("⚠️ check_and_notify_at_risk_customers CALLED for user %s", user_id)
 
     file_path = get_user_excel_path(user_id)
     if not os.path.exists(file_path):
-        logger.warning(f"Excel file for user {user_id} not found at {file_path}. Skipping at-risk check.")
+        logger.warning("Excel file for user %s not found at %s. Skipping at-risk check.", user_id, file_path)
         return
 
-    df_customers, df_transactions = load_data_from_excel(file_path)
+    # Cached readers: one workbook open at most, warm frames on repeat 📖
+    df_transactions, df_customers = excel_manager.get_all_data(file_path)
 
     if df_transactions.empty or df_customers.empty:
-        logger.info(f"User {user_id}: No customer or transaction data available for at-risk check.")
+        logger.info("User %s: No customer or transaction data available for at-risk check.", user_id)
         return
 
     # Needs enough transactions for meaningful analysis (e.g., at least 5 for KMeans to work well)
     if len(df_transactions) < 5:
-        logger.info(f"At-Risk check: Not enough transactions ({len(df_transactions)}) for user {user_id} for meaningful analysis. Skipping notification.")
+        logger.info("At-Risk check: Not enough transactions (%s) for user %s for meaningful analysis. Skipping notification.", len(df_transactions), user_id)
         return
 
     try:
         df_segmented = get_full_customer_segments_df(df_transactions, df_customers) 
 
         if df_segmented.empty:
-            logger.info(f"User {user_id}: No segmented data available for at-risk check.")
+            logger.info("User %s: No segmented data available for at-risk check.", user_id)
             return
 
         df_segmented['روز از آخرین خرید'] = pd.to_numeric(df_segmented['روز از آخرین خرید'], errors='coerce')
@@ -172,10 +179,10 @@ async def check_and_notify_at_risk_customers(user_id, context, chat_id):
         ]
 
         if at_risk_customers.empty:
-            logger.info(f"User {user_id}: Found 0 at-risk customers meeting criteria (Recency 31-90 days).")
+            logger.info("User %s: Found 0 at-risk customers meeting criteria (Recency 31-90 days).", user_id)
             return
 
-        logger.info(f"User {user_id}: Found {len(at_risk_customers)} at-risk customers meeting criteria (Recency 31-90 days).")
+        logger.info("User %s: Found %s at-risk customers meeting criteria (Recency 31-90 days).", user_id, len(at_risk_customers))
 
         for _, row in at_risk_customers.iterrows():
             customer_id = row["کد مشتری"]
@@ -196,14 +203,14 @@ async def check_and_notify_at_risk_customers(user_id, context, chat_id):
                 f"با یه یادآوری یا پیشنهاد محدود برش گردون. 💬"
             )
             if send_telegram_message(chat_id, message):
-                logger.info(f"Consolidated At-Risk notification sent to {chat_id} for user {user_id}.")
+                logger.info("Consolidated At-Risk notification sent to %s for user %s.", chat_id, user_id)
             else:
-                logger.error(f"Failed to send consolidated At-Risk notification to {chat_id} for user {user_id}.")
+                logger.error("Failed to send consolidated At-Risk notification to %s for user %s.", chat_id, user_id)
         else:
-            logger.info(f"User {user_id}: No new At-Risk customers to notify after considering cooldown.")
+            logger.info("User %s: No new At-Risk customers to notify after considering cooldown.", user_id)
 
     except Exception as e:
-        logger.error(f"Error during At-Risk notification check for user {user_id}: {e}")
+        logger.error("Error during At-Risk notification check for user %s: %s", user_id, e)
 
 
 async def check_and_notify_at_risk_customers_for_all_users(context):
@@ -227,12 +234,12 @@ async def check_and_notify_at_risk_customers_for_all_users(context):
             chat_id = get_chat_id(user_id) 
             
             if chat_id:
-                logger.info(f"Processing user {user_id} (chat_id: {chat_id}) for at-risk notifications.")
+                logger.info("Processing user %s (chat_id: %s) for at-risk notifications.", user_id, chat_id)
                 # We are passing the original context, though send_telegram_message won't use it.
                 # This keeps the function signature consistent with other async Telegram functions.
                 await check_and_notify_at_risk_customers(user_id, context, chat_id) 
             else:
-                logger.warning(f"❌ Could not find chat_id for user {user_id}. Skipping at-risk notification for this user.")
+                logger.warning("❌ Could not find chat_id for user %s. Skipping at-risk notification for this user.", user_id)
         except Exception as e:
-            logger.error(f"An error occurred during at-risk check for user {user_id}: {e}")
+            logger.error("An error occurred during at-risk check for user %s: %s", user_id, e)
 
@@ -2,6 +2,12 @@
 import json
 import os
 import logging
+import threading
+
+try:
+    import orjson  # C-accelerated JSON parsing for the per-update read path ⚡
+except ImportError:  # optional — stdlib json still works
+    orjson = None
 from datetime import datetime # Import datetime for date comparisons
 import jdatetime # Import jdatetime for Shamsi date conversion
 
@@ -13,39 +19,81 @@ USER_DATA_FILE = "user_data/users.json"
 # Directory to store user-specific notification logs and other data
 DATA_DIR = "user_data" # Ensure this is defined
 
+# In-process cache of the users.json contents, keyed by the file's mtime, so
+# every handler entry doesn't re-read and re-parse the file per update 🧠
+_user_data_cache = None
+_user_data_mtime = None
+
+# Writers are copy-on-write under this lock: the cached dict itself is never
+# mutated, so event-loop code can iterate or json.dump it while a worker
+# thread records an update without a "dict changed size" blow-up 🔒
+_user_data_write_lock = threading.Lock()
+
+def _user_data_file_mtime():
+    try:
+        return os.stat(USER_DATA_FILE).st_mtime
+    except OSError:
+        return None
+
 def load_user_data():
     """
     Loads user data (Telegram ID to phone number and chat ID mapping) from a JSON file. 📥
+    Served from an in-process cache unless the file changed on disk.
     Returns an empty dictionary if the file does not exist or is malformed. 📁
     """
+    global _user_data_cache, _user_data_mtime
+    mtime = _user_data_file_mtime()
+    if _user_data_cache is not None and _user_data_mtime == mtime:
+        return _user_data_cache
+    _user_data_cache = _load_user_data_from_disk()
+    _user_data_mtime = mtime
+    return _user_data_cache
+
+def _load_user_data_from_disk():
     if os.path.exists(USER_DATA_FILE):
         try:
-            with open(USER_DATA_FILE, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                # Ensure the loaded data is actually a dictionary
-                if not isinstance(data, dict):
-                    logger.error(f"Root of {USER_DATA_FILE} is not a dictionary (it's type: {type(data)}). Returning empty data. ❌")
-                    return {}
-                # logger.info(f"Successfully loaded user data from {USER_DATA_FILE}. Keys: {list(data.keys())[:5]}...")
-                return data
-        except json.JSONDecodeError:
-            logger.error(f"Error decoding JSON from {USER_DATA_FILE}. Returning empty data. ❌")
+            if orjson is not None:
+                with open(USER_DATA_FILE, 'rb') as f:
+                    data = orjson.loads(f.read())
+            else:
+                with open(USER_DATA_FILE, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+            # Ensure the loaded data is actually a dictionary
+            if not isinstance(data, dict):
+                logger.error("Root of %s is not a dictionary (it's type: %s). Returning empty data. ❌", USER_DATA_FILE, type(data))
+                return {}
+            # logger.info("Successfully loaded user data from %s. Keys: %s...", USER_DATA_FILE, list(data.keys())[:5])
+            return data
+        except ValueError:  # covers json.JSONDecodeError and orjson.JSONDecodeError
+            logger.error("Error decoding JSON from %s. Returning empty data. ❌", USER_DATA_FILE)
             return {}
-    logger.info(f"User data file not found at {USER_DATA_FILE}. Returning empty dictionary.")
+    logger.info("User data file not found at %s. Returning empty dictionary.", USER_DATA_FILE)
     return {}
 
+# Directory creation only needs to happen once per process 📁
+_data_dir_ready = False
+
 def save_user_data(user_data):
     """
     Saves user data to a JSON file. 💾
     Ensures the directory exists before saving. ✅
     """
-    os.makedirs(os.path.dirname(USER_DATA_FILE), exist_ok=True)
+    global _user_data_cache, _user_data_mtime, _data_dir_ready
+    if not _data_dir_ready:
+        os.makedirs(os.path.dirname(USER_DATA_FILE), exist_ok=True)
+        _data_dir_ready = True
     try:
-        with open(USER_DATA_FILE, 'w', encoding='utf-8') as f:
-            json.dump(user_data, f, indent=4, ensure_ascii=False) # ensure_ascii=False for Persian characters ✍️
-            # logger.info(f"User data saved successfully to {USER_DATA_FILE}. Keys saved: {list(user_data.keys())[:5]}...")
+        # Write to a temp file and rename so a concurrent reader never sees a
+        # half-written JSON document ✍️
+        tmp_path = USER_DATA_FILE + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(user_data, f, indent=4, ensure_ascii=False) # ensure_ascii=False for Persian characters
+        os.replace(tmp_path, USER_DATA_FILE)
+        # Keep the cache in sync with what was just written 🧠
+        _user_data_cache = user_data
+        _user_data_mtime = _user_data_file_mtime()
     except IOError as e:
-        logger.error(f"Error saving user data to {USER_DATA_FILE}: {e} 🚫")
+        logger.error("Error saving user data to %s: %s 🚫", USER_DATA_FILE, e)
 
 def get_user_phone(telegram_user_id):
     """
@@ -63,10 +111,10 @@ def get_user_phone(telegram_user_id):
             return user_info.get('phone_number')
         elif isinstance(user_info, str):
             # Old format: user_info is a direct string (the phone number)
-            logger.warning(f"Old user data format detected for user {user_id_str}. Phone number is a direct string.")
+            logger.warning("Old user data format detected for user %s. Phone number is a direct string.", user_id_str)
             return user_info # Return the phone number if it's a direct string
     
-    logger.info(f"Phone number not found or invalid format for user {user_id_str}.")
+    logger.info("Phone number not found or invalid format for user %s.", user_id_str)
     return None
 
 def get_chat_id(telegram_user_id):
@@ -79,43 +127,65 @@ def get_chat_id(telegram_user_id):
     user_id_str = str(telegram_user_id)
     user_info = user_data.get(user_id_str)
 
-    logger.info(f"Attempting to get chat_id for user {user_id_str}. user_info type: {type(user_info)}, value: {user_info}")
+    logger.info("Attempting to get chat_id for user %s. user_info type: %s, value: %s", user_id_str, type(user_info), user_info)
 
     # If user_info is a dictionary (new format)
     if user_info and isinstance(user_info, dict):
         chat_id = user_info.get('chat_id')
         if chat_id:
-            logger.info(f"Chat ID {chat_id} found for user {user_id_str}.")
+            logger.info("Chat ID %s found for user %s.", chat_id, user_id_str)
             return chat_id
         else:
-            logger.warning(f"Chat ID key missing for user {user_id_str} in user_data (new format).")
+            logger.warning("Chat ID key missing for user %s in user_data (new format).", user_id_str)
             # If chat_id is missing in new format, try to fallback to user_id (common for private chats)
             return telegram_user_id # Fallback to user_id as chat_id if not explicitly present
     # If user_info is a string (old format)
     elif isinstance(user_info, str): 
-        logger.warning(f"User data for {user_id_str} is in old string format (type: {type(user_info)}). Assuming chat_id is user_id.")
+        logger.warning("User data for %s is in old string format (type: %s). Assuming chat_id is user_id.", user_id_str, type(user_info))
         return telegram_user_id # In old format, chat_id often defaults to user_id in private chats
     
-    logger.warning(f"User {user_id_str} not found in user data.")
+    logger.warning("User %s not found in user data.", user_id_str)
     return None
 
-def get_user_phone(telegram_user_id):
-    """
-    Retrieves the phone number associated with a given Telegram user ID. 📞
-    Returns None if the user ID is not found. 🤷‍♂️
-    """
-    user_data = load_user_data()
-    # Convert telegram_user_id to string as JSON keys are strings ➡️
-    return user_data.get(str(telegram_user_id))
-
 def save_user_phone(telegram_user_id, phone_number):
     """
     Saves or updates the phone number for a given Telegram user ID. ➕
+    Writes the new dictionary format and keeps any stored chat_id intact.
+    Updates go onto a copy so the cached dict other threads hold stays frozen.
     """
-    user_data = load_user_data()
-    user_data[str(telegram_user_id)] = phone_number
-    save_user_data(user_data)
+    user_id_str = str(telegram_user_id)
+    with _user_data_write_lock:
+        user_data = dict(load_user_data())
+        user_info = user_data.get(user_id_str)
+        if isinstance(user_info, dict):
+            user_data[user_id_str] = {**user_info, 'phone_number': phone_number}
+        else:
+            user_data[user_id_str] = {'phone_number': phone_number}
+        save_user_data(user_data)
     print(f"Phone number {phone_number} saved for user {telegram_user_id} ✅")
+
+def set_chat_id(telegram_user_id, chat_id):
+    """
+    Stores the chat ID on the user's JSON record. 💬
+    Skips the disk write entirely when the value is unchanged, and upgrades
+    old string-format records (bare phone number) to dictionaries.
+    Updates go onto a copy so the cached dict other threads hold stays frozen.
+    """
+    user_id_str = str(telegram_user_id)
+    with _user_data_write_lock:
+        user_data = load_user_data()
+        user_info = user_data.get(user_id_str)
+        if isinstance(user_info, dict):
+            if user_info.get('chat_id') == chat_id:
+                return  # nothing changed — no write 🧘
+            updated = {**user_info, 'chat_id': chat_id}
+        elif isinstance(user_info, str):
+            updated = {'phone_number': user_info, 'chat_id': chat_id}
+        else:
+            updated = {'chat_id': chat_id}
+        user_data = dict(user_data)
+        user_data[user_id_str] = updated
+        save_user_data(user_data)
     
 
 def has_notification_been_sent(user_id, customer_id, notif_type, cooldown_days=0):
@@ -131,7 +201,7 @@ def has_notification_been_sent(user_id, customer_id, notif_type, cooldown_days=0
             with open(log_file_path, 'r', encoding='utf-8') as f:
                 log_data = json.load(f)
         except json.JSONDecodeError:
-            logger.error(f"Error decoding notification log JSON from {log_file_path}. Starting fresh.")
+            logger.error("Error decoding notification log JSON from %s. Starting fresh.", log_file_path)
             log_data = {}
 
     key = f"{customer_id}_{notif_type}"
@@ -144,10 +214,10 @@ def has_notification_been_sent(user_id, customer_id, notif_type, cooldown_days=0
             current_date = datetime(current_greg_date.year, current_greg_date.month, current_greg_date.day)
             
             if (current_date - last_sent_date).days < cooldown_days:
-                logger.info(f"Notification '{notif_type}' for customer '{customer_id}' by user '{user_id}' is still in cooldown.")
+                logger.info("Notification '%s' for customer '%s' by user '%s' is still in cooldown.", notif_type, customer_id, user_id)
                 return True
         except ValueError:
-            logger.warning(f"Invalid date format in notification log for key {key}: {last_sent_str}. Treating as never sent.")
+            logger.warning("Invalid date format in notification log for key %s: %s. Treating as never sent.", key, last_sent_str)
             return False # Treat as never sent if date format is invalid
     return False
 
@@ -165,7 +235,7 @@ def save_notification(user_id, customer_id, notif_type):
             with open(log_file_path, 'r', encoding='utf-8') as f:
                 log_data = json.load(f)
         except json.JSONDecodeError:
-            logger.error(f"Error decoding notification log JSON from {log_file_path}. Overwriting.")
+            logger.error("Error decoding notification log JSON from %s. Overwriting.", log_file_path)
             log_data = {}
             
     key = f"{customer_id}_{notif_type}"
@@ -176,7 +246,7 @@ def save_notification(user_id, customer_id, notif_type):
     try:
         with open(log_file_path, 'w', encoding='utf-8') as f:
             json.dump(log_data, f, indent=4, ensure_ascii=False)
-        logger.info(f"Notification '{notif_type}' for customer '{customer_id}' by user '{user_id}' logged successfully.")
+        logger.info("Notification '%s' for customer '%s' by user '%s' logged successfully.", notif_type, customer_id, user_id)
     except IOError as e:
-        logger.error(f"Error saving notification log to {log_file_path}: {e}")
+        logger.error("Error saving notification log to %s: %s", log_file_path, e)
 